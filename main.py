@@ -1,11 +1,18 @@
 import os
-import json
+import sys
+import html
 import asyncio
 import logging
+import mmap
+import sqlite3
 from datetime import datetime, timezone
+from operator import itemgetter
 
+import orjson
 import telegram
+from telegram.error import RetryAfter
 from telegram.ext import Application, CommandHandler
+from telegram.request import HTTPXRequest
 from fastapi import FastAPI, Request, HTTPException
 from typing import List, Optional
 
@@ -23,76 +30,246 @@ if not BOT_TOKEN or not ADMIN_CHAT_ID:
     # Краще не викидати ValueError, а завершити програму або повідомити користувача
     exit("Помилка конфігурації: Переконайтеся, що BOT_TOKEN та CHAT_ID встановлені.")
 
-# --- Файл історії та ліміт ---
+# Числовий ID для швидкої перевірки доступу в командах.
+# CHAT_ID може бути і назвою каналу (@channel) — тоді /latest просто недоступна.
+ADMIN_CHAT_ID_INT = int(ADMIN_CHAT_ID) if ADMIN_CHAT_ID.lstrip('-').isdigit() else None
+
+# --- База історії та ліміт ---
+# SQLite у режимі WAL дозволяє кільком воркерам Uvicorn ділити історію.
+# HISTORY_FILE — старий JSON, імпортується в базу один раз, якщо вона порожня.
+HISTORY_DB = "scan_history.db"
 HISTORY_FILE = "scan_history.json"
 MAX_HISTORY_SIZE = 5
+HISTORY_MMAP_THRESHOLD = 64 * 1024 # байти; більші JSON файли читаємо через mmap
+
+# --- Формат часу для повідомлень ---
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Python 3.11+ сам розуміє суфікс 'Z' у fromisoformat
+if sys.version_info >= (3, 11):
+    _parse_iso = datetime.fromisoformat
+else:
+    def _parse_iso(value: str) -> datetime:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def format_scan_time(occurred_at: str) -> str:
+    # Враховуємо 'Z' як UTC і перетворюємо в локальний час
+    scan_time = _parse_iso(occurred_at)
+    # astimezone() без аргументу бере зсув локальної зони саме для цього моменту (з урахуванням DST)
+    return scan_time.astimezone().strftime(DATE_FORMAT)
+
+# --- Підключення до бази історії (одне на воркер) ---
+_db: Optional[sqlite3.Connection] = None
+_HISTORY_LOCK = asyncio.Lock()
 
 # --- Функції для роботи з історією ---
-def load_history() -> List[dict]:
+def _read_history_file() -> List[dict]:
     try:
         if os.path.exists(HISTORY_FILE):
-            with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(HISTORY_FILE, 'rb') as f:
+                # Великий файл парсимо напряму з mmap, без копії в bytes
+                if os.fstat(f.fileno()).st_size > HISTORY_MMAP_THRESHOLD:
+                    with mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ) as mm, memoryview(mm) as view:
+                        return orjson.loads(view)
+                return orjson.loads(f.read())
         return []
-    except (json.JSONDecodeError) as e:
+    except (orjson.JSONDecodeError) as e:
         logger.error(f"Помилка декодування JSON файлу історії: {e}")
         return []
 
-def save_history(history: List[dict]):
+def _as_text(value) -> Optional[str]:
+    return None if value is None else str(value)
+
+def _open_history_db() -> sqlite3.Connection:
+    conn = sqlite3.connect(HISTORY_DB, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS scans ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "caseName TEXT, patientName TEXT, occurredAt TEXT, formatted TEXT)"
+    )
+    # Тримаємо в таблиці тільки MAX_HISTORY_SIZE останніх записів
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS scans_limit AFTER INSERT ON scans BEGIN "
+        "DELETE FROM scans WHERE id NOT IN "
+        f"(SELECT id FROM scans ORDER BY id DESC LIMIT {MAX_HISTORY_SIZE}); "
+        "END"
+    )
+    # Одноразовий перенос історії зі старого JSON файлу
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-            json.dump(history, f, indent=4, ensure_ascii=False)
-    except IOError as e:
-        logger.error(f"Помилка запису файлу історії: {e}")
+        if conn.execute("SELECT COUNT(*) FROM scans").fetchone()[0] == 0:
+            legacy_history = _read_history_file()
+            if not isinstance(legacy_history, list):
+                logger.warning("Старий файл історії не є списком, імпорт пропущено.")
+                legacy_history = []
+            # У JSON найновіші записи йдуть першими
+            for scan in reversed(legacy_history):
+                if not isinstance(scan, dict):
+                    logger.warning(f"Пропущено невірний запис старої історії: {scan!r}")
+                    continue
+                # Старий JSON міг містити об'єкти замість рядків — SQLite їх не прийме
+                conn.execute(
+                    "INSERT INTO scans (caseName, patientName, occurredAt, formatted) VALUES (?, ?, ?, ?)",
+                    tuple(_as_text(scan.get(key)) for key in ('caseName', 'patientName', 'occurredAt', '_formatted')),
+                )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return conn
+
+def _select_history() -> List[dict]:
+    rows = _db.execute(
+        "SELECT caseName, patientName, occurredAt, formatted FROM scans ORDER BY id DESC LIMIT ?",
+        (MAX_HISTORY_SIZE,),
+    ).fetchall()
+    return [
+        {'caseName': case_name, 'patientName': patient_name, 'occurredAt': occurred_at, '_formatted': formatted}
+        for case_name, patient_name, occurred_at, formatted in rows
+    ]
+
+def _insert_history(entry: dict):
+    _db.execute(
+        "INSERT INTO scans (caseName, patientName, occurredAt, formatted) VALUES (?, ?, ?, ?)",
+        (entry.get('caseName'), entry.get('patientName'), entry.get('occurredAt'), entry.get('_formatted')),
+    )
+
+async def _run_in_db_thread(func, *args):
+    # Скасування задачі не зупиняє потік із запитом, тому при скасуванні
+    # дочікуємося його завершення, не відпускаючи замок — інакше close() піде паралельно
+    async with _HISTORY_LOCK:
+        future = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.wait({future})
+            raise
+
+async def load_history() -> List[dict]:
+    return await _run_in_db_thread(_select_history)
+
+async def add_to_history(entry: dict):
+    await _run_in_db_thread(_insert_history, entry)
 
 # --- Ініціалізація Telegram Bot Application ---
-application = Application.builder().token(BOT_TOKEN).build()
+# Один HTTP/2 клієнт з великим пулом з'єднань для всіх відправок у Telegram
+telegram_request = HTTPXRequest(
+    connection_pool_size=32,
+    connect_timeout=5,
+    read_timeout=10,
+    http_version="2",
+)
+application = Application.builder().token(BOT_TOKEN).request(telegram_request).build()
 # Глобальний об'єкт bot, який можна використовувати в FastAPI ендпоінтах
 telegram_bot = application.bot
 
+# --- Фонова відправка повідомлень ---
+# Вебхук не чекає відповіді Telegram; семафор обмежує кількість фонових відправок
+SEND_MAX_RETRIES = 3
+SEND_DRAIN_TIMEOUT = 10.0 # секунди на відправку залишку повідомлень при зупинці
+_SEND_SEMAPHORE = asyncio.Semaphore(50)
+_send_tasks: set = set()
+
+async def _send_message_safe(**kwargs):
+    try:
+        for attempt in range(SEND_MAX_RETRIES + 1):
+            try:
+                await telegram_bot.send_message(**kwargs)
+                return
+            except RetryAfter as e:
+                # Ліміт Telegram на кількість повідомлень — чекаємо і пробуємо знову
+                if attempt == SEND_MAX_RETRIES:
+                    raise
+                logger.warning(f"Telegram просить зачекати {e.retry_after} с перед відправкою.")
+                await asyncio.sleep(e.retry_after)
+    except Exception as e:
+        logger.error(f"Помилка відправки повідомлення в Telegram: {e}", exc_info=True)
+    finally:
+        _SEND_SEMAPHORE.release()
+
+def _start_send_task(**kwargs):
+    # Викликається тільки після того, як місце в семафорі вже зайняте
+    task = asyncio.create_task(_send_message_safe(**kwargs))
+    # Тримаємо посилання на задачу, щоб її не прибрав збирач сміття
+    _send_tasks.add(task)
+    task.add_done_callback(_send_tasks.discard)
+
+async def send_message_in_background(**kwargs):
+    # Місце в семафорі займаємо до створення задачі, щоб задач не ставало більше ліміту
+    await _SEND_SEMAPHORE.acquire()
+    _start_send_task(**kwargs)
+
+async def send_message_nowait(**kwargs):
+    # Для HTTP обробників: не чекаємо вільного місця, а відкидаємо повідомлення
+    if _SEND_SEMAPHORE.locked():
+        logger.warning("Усі слоти відправки в Telegram зайняті, повідомлення відкинуто.")
+        return
+    # Семафор не заблокований, тож acquire() повертається одразу, без очікування
+    await _SEND_SEMAPHORE.acquire()
+    _start_send_task(**kwargs)
+
 # --- Command Handler ---
+# Статичні фрагменти повідомлення /latest
+_LATEST_HEADER = "<b>Останні 5 отриманих сканів:</b>\n"
+_LATEST_CASE_PREFIX = ". <b>"
+_LATEST_PATIENT_PREFIX = "</b>\n   Пацієнт: "
+_LATEST_TIME_PREFIX = "\n   Час: "
+
 async def latest_scans_command(update: telegram.Update, context: telegram.ext.ContextTypes.DEFAULT_TYPE):
-    if str(update.effective_chat.id) != str(ADMIN_CHAT_ID):
+    if update.effective_chat.id != ADMIN_CHAT_ID_INT:
         await update.message.reply_text("Ця команда доступна тільки в авторизованому чаті.")
         return
 
-    history = load_history()
+    history = await load_history()
 
     if not history:
         await update.message.reply_text("Історія сканів поки що порожня.")
         return
 
-    message_lines = ["<b>Останні 5 отриманих сканів:</b>\n"]
+    parts = [_LATEST_HEADER]
     for i, scan in enumerate(history, 1):
         scan_time_str = scan.get('occurredAt')
-        case_name = scan.get('caseName', 'Невідомий кейс')
-        patient_name = scan.get('patientName', 'Невідомий пацієнт')
-        
-        formatted_date = "Невідомий час"
-        if scan_time_str:
-            try:
-                # Враховуємо 'Z' як UTC і перетворюємо в локальний час
-                scan_time = datetime.fromisoformat(scan_time_str.replace('Z', '+00:00'))
-                local_time = scan_time.astimezone(datetime.now(timezone.utc).astimezone().tzinfo)
-                formatted_date = local_time.strftime('%Y-%m-%d %H:%M:%S')
-            except ValueError:
-                logger.warning(f"Невірний формат часу в історії: {scan_time_str}")
-
-        message_lines.append(
-            f"{i}. <b>{case_name}</b>\n"
-            f"   Пацієнт: {patient_name}\n"
-            f"   Час: {formatted_date}\n"
-        )
+        case_name = scan.get('caseName') or 'Невідомий кейс'
+        patient_name = scan.get('patientName') or 'Невідомий пацієнт'
+
+        formatted_date = scan.get('_formatted')
+        if formatted_date is None:
+            # Старі записи історії без готового рядка часу
+            formatted_date = "Невідомий час"
+            if scan_time_str:
+                try:
+                    formatted_date = format_scan_time(scan_time_str)
+                except ValueError:
+                    logger.warning(f"Невірний формат часу в історії: {scan_time_str}")
+
+        parts.extend((
+            "\n", str(i), _LATEST_CASE_PREFIX, html.escape(case_name),
+            _LATEST_PATIENT_PREFIX, html.escape(patient_name),
+            _LATEST_TIME_PREFIX, formatted_date, "\n",
+        ))
 
-    await update.message.reply_text("\n".join(message_lines), parse_mode='HTML')
+    await update.message.reply_text("".join(parts), parse_mode='HTML')
 
 application.add_handler(CommandHandler("latest", latest_scans_command))
 
+# --- Черга вебхуків ---
+WEBHOOK_QUEUE_SIZE = 1000
+WEBHOOK_DRAIN_TIMEOUT = 10.0 # секунди на обробку залишку черги при зупинці
+WEBHOOK_QUEUE: asyncio.Queue = asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+_worker_task: Optional[asyncio.Task] = None
+
 # --- Ініціалізація FastAPI ---
 app = FastAPI(title="Medit Link Webhook Processor")
 
 @app.on_event("startup")
 async def startup_event():
+    global _db, _worker_task
+    # Кожен воркер відкриває власне підключення до бази історії
+    _db = await asyncio.to_thread(_open_history_db)
+    _worker_task = asyncio.create_task(_worker())
     # Ініціалізуємо та запускаємо Telegram Application
     await application.initialize()
     await application.start()
@@ -100,116 +277,189 @@ async def startup_event():
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    # Даємо обробнику дочитати чергу: Medit не повторює вже підтверджені вебхуки
+    if _worker_task:
+        try:
+            await asyncio.wait_for(WEBHOOK_QUEUE.join(), timeout=WEBHOOK_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(f"Не встигли обробити {WEBHOOK_QUEUE.qsize()} подій Medit до зупинки, їх втрачено.")
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+    # Чекаємо відправки повідомлень, поки HTTP клієнт бота ще відкритий
+    if _send_tasks:
+        _, pending = await asyncio.wait(set(_send_tasks), timeout=SEND_DRAIN_TIMEOUT)
+        if pending:
+            logger.error(f"Не встигли відправити {len(pending)} повідомлень у Telegram до зупинки, їх втрачено.")
+            for task in pending:
+                task.cancel()
+            await asyncio.wait(pending)
     # Зупиняємо Telegram Application
     await application.stop()
     await application.shutdown()
     logger.info("Telegram Bot зупинено.")
+    # Базу закриваємо останньою і під замком: запит, що вже виконується в потоці,
+    # тримає замок до свого завершення навіть після скасування задачі (_run_in_db_thread)
+    if _db:
+        async with _HISTORY_LOCK:
+            _db.close()
+
+# --- Обробка подій Medit ---
+def dig(data, *keys):
+    # Дістає вкладене значення за ланцюжком ключів; None, якщо шляху немає
+    try:
+        for key in keys:
+            data = data[key]
+        return data
+    except (KeyError, IndexError, TypeError):
+        return None
+
+# Шаблони повідомлень у Telegram (Markdown)
+_CASE_MSG_TMPL = "Новий кейс: **{case_name}**\nПацієнт: {patient_name}\nСтатус: {status}\n"
+_ORDER_MSG_TMPL = (
+    "Нове замовлення №`{order_number}`\n"
+    "Від: `{seller_name}`\n"
+    "Кейс: **{case_name}**\n"
+    "Пацієнт: {patient_name}\n"
+    "Статус замовлення: {status}\n"
+)
+_NOTIFY_MSG_TMPL = "✅ {message_info}Час: {occurred_at}"
+
+# Варіант 1: Подія з 'case' на верхньому рівні
+def _describe_case_event(case_data: dict, occurred_at: str):
+    case_name = case_data.get('name')
+    # Якщо є пацієнт, спробуємо отримати його ім'я
+    patient_name = dig(case_data, 'patient', 'name')
+
+    # Для case подій, час створення або сканування може бути у 'dateCreated'/'dateScanned'
+    if case_data.get('dateScanned'):
+        occurred_at = case_data['dateScanned']
+    elif case_data.get('dateCreated'):
+        occurred_at = case_data['dateCreated']
+
+    message_info = _CASE_MSG_TMPL.format_map({
+        'case_name': case_name if case_name else 'Невідомий',
+        'patient_name': patient_name if patient_name else 'Невідомий',
+        'status': case_data.get('status', 'Невідомий'),
+    })
+    return case_name, patient_name, occurred_at, message_info
+
+# Варіант 2: Подія з 'order', де 'case' вкладений
+def _describe_order_event(order_data: dict, occurred_at: str):
+    # Спроба отримати case_name та patient_name з вкладеного 'case'
+    case_name = dig(order_data, 'case', 'name')
+    patient_name = dig(order_data, 'case', 'patient', 'name')
+
+    order_number = order_data.get('orderNumber', 'N/A')
+    seller_name = dig(order_data, 'seller', 'name') or 'N/A'
+
+    # Для order подій, час може бути 'dateCreated'
+    if order_data.get('dateCreated'):
+        occurred_at = order_data['dateCreated']
+
+    message_info = _ORDER_MSG_TMPL.format_map({
+        'order_number': order_number,
+        'seller_name': seller_name,
+        'case_name': case_name if case_name else 'Невідомий',
+        'patient_name': patient_name if patient_name else 'Невідомий',
+        'status': order_data.get('status', 'Невідомий'),
+    })
+    return case_name, patient_name, occurred_at, message_info
+
+# Таблиця відомих форматів подій: (перевірка, витяг даних, опис події).
+# Будується один раз при імпорті; перший збіг визначає тип події.
+EVENT_EXTRACTORS = (
+    (lambda e: isinstance(e.get('case'), dict), itemgetter('case'), _describe_case_event),
+    (lambda e: isinstance(e.get('order'), dict), itemgetter('order'), _describe_order_event),
+)
+
+async def _process_event(event: dict):
+    logger.info(f"Отримано вебхук Medit: {orjson.dumps(event).decode()}") # Логуємо для дебагу
+
+    occurred_at: str = datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z') # Час отримання вебхука за замовчуванням
+
+    # --- Логіка обробки різних типів подій ---
+    extractors = EVENT_EXTRACTORS if isinstance(event, dict) else ()
+    for matches, extract, describe in extractors:
+        if matches(event):
+            case_name, patient_name, occurred_at, message_info = describe(extract(event), occurred_at)
+            # В історії зберігаємо тільки рядки, навіть якщо Medit прислав об'єкт
+            case_name, patient_name = _as_text(case_name), _as_text(patient_name)
+            formatted_date = format_scan_time(occurred_at)
+            break
+    else:
+        # Якщо формат не розпізнано
+        logger.warning(f"Отримано нерозпізнаний вебхук Medit: {orjson.dumps(event).decode()}")
+        await send_message_in_background(
+            chat_id=ADMIN_CHAT_ID,
+            text=f"⚠️ **Увага:** Отримано нерозпізнану подію Medit.\n\n`{orjson.dumps(event, option=orjson.OPT_INDENT_2).decode()}`",
+            parse_mode='Markdown'
+        )
+        return
+
+    # --- Збереження історії ---
+    if case_name: # Зберігаємо в історію тільки якщо вдалося отримати case_name
+        await add_to_history({
+            'caseName': case_name,
+            'patientName': patient_name,
+            'occurredAt': occurred_at,
+            # Готовий рядок часу для /latest, щоб не парсити дату на кожну команду
+            '_formatted': formatted_date
+        })
+
+        # --- Відправка повідомлення в Telegram ---
+        await send_message_in_background(
+            chat_id=ADMIN_CHAT_ID,
+            text=_NOTIFY_MSG_TMPL.format_map({'message_info': message_info, 'occurred_at': formatted_date}),
+            parse_mode='Markdown'
+        )
+    else:
+        logger.warning("Не вдалося отримати case_name для збереження в історію.")
+
+async def _send_error_report(e: Exception, event_text: str, wait: bool = True):
+    logger.error(f"Помилка при обробці вебхука Medit: {e}", exc_info=True)
+    # Відправка повідомлення про помилку в Telegram;
+    # з HTTP обробника (wait=False) не чекаємо вільного слоту, щоб не затримувати відповідь
+    if ADMIN_CHAT_ID:
+        send = send_message_in_background if wait else send_message_nowait
+        await send(
+            chat_id=ADMIN_CHAT_ID,
+            text=f"❌ **Помилка при обробці вебхука Medit:**\n`{e}`\n\n**Подія:**\n`{event_text[:2000] or 'N/A'}`",
+            parse_mode='Markdown'
+        )
+
+async def _worker():
+    # Обробляємо події з черги по одній, незалежно від відповіді на вебхук
+    while True:
+        event = await WEBHOOK_QUEUE.get()
+        try:
+            await _process_event(event)
+        except Exception as e:
+            await _send_error_report(e, str(event))
+        finally:
+            WEBHOOK_QUEUE.task_done()
 
 # --- Webhook Endpoint ---
 @app.post("/webhook/medit")
 async def handle_medit_webhook(request: Request):
+    # Тільки розбираємо JSON і ставимо подію в чергу — обробка йде у фоні
+    # Тіло читаємо один раз; у разі помилки показуємо сирі байти без повторного розбору
+    raw = b""
     try:
-        event = await request.json()
-        logger.info(f"Отримано вебхук Medit: {json.dumps(event, ensure_ascii=False)}") # Логуємо для дебагу
-
-        case_name: Optional[str] = None
-        patient_name: Optional[str] = None
-        occurred_at: Optional[str] = datetime.now(timezone.utc).isoformat(timespec='milliseconds') + 'Z' # Час отримання вебхука за замовчуванням
-
-        # --- Логіка обробки різних типів подій ---
-        # Варіант 1: Подія з 'case' на верхньому рівні
-        if 'case' in event and isinstance(event['case'], dict):
-            case_data = event['case']
-            case_name = case_data.get('name')
-            
-            # Якщо є пацієнт, спробуємо отримати його ім'я
-            patient_data = case_data.get('patient')
-            if isinstance(patient_data, dict):
-                patient_name = patient_data.get('name') # Можливо, 'name' в patient
-            
-            # Для case подій, час створення або сканування може бути у 'dateCreated'/'dateScanned'
-            if case_data.get('dateScanned'):
-                occurred_at = case_data['dateScanned']
-            elif case_data.get('dateCreated'):
-                occurred_at = case_data['dateCreated']
-
-            message_info = f"Новий кейс: **{case_name if case_name else 'Невідомий'}**\n"
-            message_info += f"Пацієнт: {patient_name if patient_name else 'Невідомий'}\n"
-            message_info += f"Статус: {case_data.get('status', 'Невідомий')}\n"
-            message_info += f"Час: {datetime.fromisoformat(occurred_at.replace('Z', '+00:00')).astimezone(datetime.now(timezone.utc).astimezone().tzinfo).strftime('%Y-%m-%d %H:%M:%S')}"
-            
-        # Варіант 2: Подія з 'order', де 'case' вкладений
-        elif 'order' in event and isinstance(event['order'], dict):
-            order_data = event['order']
-            
-            # Спроба отримати case_name та patient_name з вкладеного 'case'
-            if 'case' in order_data and isinstance(order_data['case'], dict):
-                case_data_in_order = order_data['case']
-                case_name = case_data_in_order.get('name')
-                
-                patient_data = case_data_in_order.get('patient')
-                if isinstance(patient_data, dict):
-                    patient_name = patient_data.get('name') # Можливо, 'name' в patient
-
-            order_number = order_data.get('orderNumber', 'N/A')
-            seller_name = order_data.get('seller', {}).get('name', 'N/A')
-            
-            # Для order подій, час може бути 'dateCreated'
-            if order_data.get('dateCreated'):
-                occurred_at = order_data['dateCreated']
-
-            message_info = f"Нове замовлення №`{order_number}`\n"
-            message_info += f"Від: `{seller_name}`\n"
-            message_info += f"Кейс: **{case_name if case_name else 'Невідомий'}**\n"
-            message_info += f"Пацієнт: {patient_name if patient_name else 'Невідомий'}\n"
-            message_info += f"Статус замовлення: {order_data.get('status', 'Невідомий')}\n"
-            message_info += f"Час: {datetime.fromisoformat(occurred_at.replace('Z', '+00:00')).astimezone(datetime.now(timezone.utc).astimezone().tzinfo).strftime('%Y-%m-%d %H:%M:%S')}"
-
-        else:
-            # Якщо формат не розпізнано
-            logger.warning(f"Отримано нерозпізнаний вебхук Medit: {json.dumps(event, ensure_ascii=False)}")
-            await telegram_bot.send_message(
-                chat_id=ADMIN_CHAT_ID,
-                text=f"⚠️ **Увага:** Отримано нерозпізнану подію Medit.\n\n`{json.dumps(event, indent=2, ensure_ascii=False)}`",
-                parse_mode='Markdown'
-            )
-            return {"status": "error", "message": "Unrecognized event format"}, 400
-
-        # --- Збереження історії ---
-        if case_name: # Зберігаємо в історію тільки якщо вдалося отримати case_name
-            history = load_history()
-            history.insert(0, {
-                'caseName': case_name,
-                'patientName': patient_name,
-                'occurredAt': occurred_at
-            })
-            if len(history) > MAX_HISTORY_SIZE:
-                history = history[:MAX_HISTORY_SIZE]
-            save_history(history)
-
-            # --- Відправка повідомлення в Telegram ---
-            await telegram_bot.send_message(
-                chat_id=ADMIN_CHAT_ID,
-                text=f"✅ {message_info}",
-                parse_mode='Markdown'
-            )
-        else:
-            logger.warning("Не вдалося отримати case_name для збереження в історію.")
-
-
-        return {"status": "success", "message": "Webhook processed"}
-
+        raw = await request.body()
+        event = orjson.loads(raw)
+        WEBHOOK_QUEUE.put_nowait(event)
+    except asyncio.QueueFull:
+        logger.error("Черга вебхуків Medit переповнена, подію відхилено.")
+        raise HTTPException(status_code=503, detail="Webhook queue is full")
     except Exception as e:
-        logger.error(f"Помилка при обробці вебхука Medit: {e}", exc_info=True)
-        # Відправка повідомлення про помилку в Telegram
-        if ADMIN_CHAT_ID:
-            await telegram_bot.send_message(
-                chat_id=ADMIN_CHAT_ID,
-                text=f"❌ **Помилка при обробці вебхука Medit:**\n`{e}`\n\n**Подія:**\n`{json.dumps(await request.json(), indent=2, ensure_ascii=False) if await request.body() else 'N/A'}`",
-                parse_mode='Markdown'
-            )
+        await _send_error_report(e, raw.decode('utf-8', 'replace'), wait=False)
         raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
 
+    return {"status": "success", "message": "Webhook accepted"}
+
 # --- Root Endpoint ---
 @app.get("/")
 def root():